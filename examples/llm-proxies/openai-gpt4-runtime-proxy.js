@@ -8,73 +8,154 @@
  * - OPENAI_API_KEY: Your OpenAI API key (required)
  * - OPENAI_MODEL: Model to use (default: gpt-4o)
  * - OPENAI_BASE_URL: Custom OpenAI-compatible endpoint (optional)
+ * - GEMINI_DEBUG_ENABLED: Set to 'true' for per-request debug logging (optional)
  */
 
 const fs = require('fs');
+const crypto = require('crypto');
 
 // Configuration from environment
 const OPENAI_API_KEY = process.env.OPENAI_API_KEY;
 const OPENAI_MODEL = process.env.OPENAI_MODEL || 'gpt-4o';
 const OPENAI_BASE_URL = process.env.OPENAI_BASE_URL || 'https://api.openai.com';
+const DEBUG_LOGGING = process.env.GEMINI_DEBUG_ENABLED === 'true';
 
 if (!OPENAI_API_KEY) {
     console.error('❌ ERROR: OPENAI_API_KEY environment variable is required');
     process.exit(1);
 }
 
+// Request URL and headers never change for the process lifetime, so build them once
+const OPENAI_CHAT_URL = `${OPENAI_BASE_URL}/v1/chat/completions`;
+const OPENAI_HEADERS = Object.freeze({
+    'Content-Type': 'application/json',
+    'Authorization': `Bearer ${OPENAI_API_KEY}`,
+    'User-Agent': 'GeminiCLI-OpenAI-Proxy/1.0'
+});
+const STREAM_RESPONSE_HEADERS = Object.freeze({ 'Content-Type': 'text/event-stream' });
+
+// Matches Gemini API URLs in one scan; group 1 is set for streaming calls
+const GEMINI_API_URL_RE = /^https:\/\/generativelanguage\.googleapis\.com\/[^?]*?(:streamGenerateContent)?(?:\?|$)/;
+
+// Larger request bodies are rejected before parsing to bound memory use
+const MAX_REQUEST_BODY_BYTES = 8 * 1024 * 1024;
+
+// Deterministic (temperature 0) non-streaming responses are cached in-process
+// so re-asked prompts skip the OpenAI round-trip entirely
+const RESPONSE_CACHE_MAX_ENTRIES = 1024;
+const RESPONSE_CACHE_TTL_MS = 5 * 60 * 1000;
+const responseCache = new Map();
+
 console.log('🔧 OpenAI Runtime Proxy: Patching global fetch...');
 console.log(`📡 Target: ${OPENAI_BASE_URL}`);
 console.log(`🤖 Model: ${OPENAI_MODEL}`);
 
-// Store original fetch
+// Store original fetch. Node's built-in fetch (undici) keeps a pool of
+// keep-alive connections per origin, so repeated OpenAI calls reuse warm
+// TCP/TLS sockets as long as no 'Connection: close' header is sent.
 const originalFetch = global.fetch;
 
-// Log to file for debugging
+// Log to file for debugging. Lines are queued and written with a single
+// write per event-loop turn through a descriptor opened once, instead of an
+// open/write/close per line. The write is synchronous so batches stay in
+// order and nothing is in flight when the exit hook flushes the remainder.
 const logFile = 'openai-runtime-proxy.log';
-function logToFile(message) {
-    const timestamp = new Date().toISOString();
-    const logMessage = `[${timestamp}] ${message}\n`;
+let logFd = null;
+try {
+    logFd = fs.openSync(logFile, 'a');
+} catch (e) {
+    // If the log file can't be opened, just use console
+}
+let pendingLogLines = [];
+let logFlushScheduled = false;
+
+function flushLogLines() {
+    logFlushScheduled = false;
+    if (logFd === null || pendingLogLines.length === 0) {
+        return;
+    }
+    const batch = pendingLogLines.join('');
+    pendingLogLines = [];
     try {
-        fs.appendFileSync(logFile, logMessage);
+        fs.writeSync(logFd, batch);
     } catch (e) {
-        // If file write fails, just use console
+        // If file write fails, the console copy is still there
+    }
+}
+
+process.on('exit', flushLogLines);
+
+function logToFile(message) {
+    const timestamp = new Date().toISOString();
+    if (logFd !== null) {
+        pendingLogLines.push(`[${timestamp}] ${message}\n`);
+        if (!logFlushScheduled) {
+            logFlushScheduled = true;
+            setImmediate(flushLogLines);
+        }
     }
     console.log(`🟨 PROXY: ${message}`);
 }
 
+// Verbose per-request lines, only emitted when GEMINI_DEBUG_ENABLED=true
+function logDebug(message) {
+    if (DEBUG_LOGGING) {
+        logToFile(message);
+    }
+}
+
 /**
- * Convert Gemini request format to OpenAI format
+ * Concatenate the text parts of one Gemini content entry
  */
-function convertGeminiToOpenAI(geminiRequest) {
-    const messages = [];
+function joinTextParts(parts) {
+    let text = '';
     
-    if (geminiRequest.contents) {
-        for (const content of geminiRequest.contents) {
-            const role = content.role || 'user';
-            let text = '';
-            
-            if (content.parts) {
-                for (const part of content.parts) {
-                    if (part.text) {
-                        text += part.text;
-                    }
-                }
+    if (parts) {
+        for (const part of parts) {
+            if (part.text) {
+                text += part.text;
             }
-            
-            messages.push({
-                role: role === 'model' ? 'assistant' : role,
-                content: text
-            });
         }
     }
     
-    return {
+    return text;
+}
+
+/**
+ * Convert Gemini request format to OpenAI format
+ */
+function convertGeminiToOpenAI(geminiRequest, stream = false) {
+    const messages = (geminiRequest.contents || []).map((content) => {
+        const role = content.role || 'user';
+        return {
+            role: role === 'model' ? 'assistant' : role,
+            content: joinTextParts(content.parts)
+        };
+    });
+    
+    const openaiRequest = {
         model: OPENAI_MODEL,
         messages: messages,
-        temperature: geminiRequest.generationConfig?.temperature || 0.1,
+        // An explicit temperature (including the CLI's default of 0) is passed through as-is
+        temperature: geminiRequest.generationConfig?.temperature ?? 0.1,
         max_tokens: geminiRequest.generationConfig?.maxOutputTokens || 4096,
         top_p: geminiRequest.generationConfig?.topP || 1.0
     };
+    
+    if (stream) {
+        openaiRequest.stream = true;
+        // Without this OpenAI sends no usage chunk and streamed turns carry no token counts
+        openaiRequest.stream_options = { include_usage: true };
+    }
+    
+    return openaiRequest;
+}
+
+/**
+ * Map an OpenAI finish_reason to the Gemini finishReason enum
+ */
+function convertFinishReason(finishReason) {
+    return finishReason === 'stop' ? 'STOP' : 'OTHER';
 }
 
 /**
@@ -91,7 +172,7 @@ function convertOpenAIToGemini(openaiResponse) {
                     }],
                     role: 'model'
                 },
-                finishReason: choice.finish_reason === 'stop' ? 'STOP' : 'OTHER',
+                finishReason: convertFinishReason(choice.finish_reason),
                 index: 0
             }],
             usageMetadata: {
@@ -114,28 +195,209 @@ function convertOpenAIToGemini(openaiResponse) {
     };
 }
 
+/**
+ * Look up a cached Gemini response body, refreshing its LRU position
+ */
+function getCachedResponse(key) {
+    const entry = responseCache.get(key);
+    if (!entry) {
+        return null;
+    }
+    responseCache.delete(key);
+    if (entry.expiresAt <= Date.now()) {
+        return null;
+    }
+    responseCache.set(key, entry);
+    return entry.body;
+}
+
+/**
+ * Store a Gemini response body, evicting the least recently used entry when full
+ */
+function setCachedResponse(key, body) {
+    responseCache.delete(key);
+    if (responseCache.size >= RESPONSE_CACHE_MAX_ENTRIES) {
+        responseCache.delete(responseCache.keys().next().value);
+    }
+    responseCache.set(key, { body: body, expiresAt: Date.now() + RESPONSE_CACHE_TTL_MS });
+}
+
+/**
+ * Wrap a serialized Gemini response in the minimal Response shape the CLI reads
+ */
+function createGeminiResponse(body, parsed) {
+    return {
+        ok: true,
+        status: 200,
+        headers: {
+            get: (key) => key === 'content-type' ? 'application/json' : null
+        },
+        json: async () => parsed ?? JSON.parse(body),
+        text: async () => body,
+        clone: function() { return this; }
+    };
+}
+
+/**
+ * Build the error response returned to the CLI when a request can't be proxied
+ */
+function createErrorResponse(status, message) {
+    const errorBody = { error: { message: message } };
+    const errorBodyText = JSON.stringify(errorBody);
+    return {
+        ok: false,
+        status: status,
+        json: async () => errorBody,
+        text: async () => errorBodyText
+    };
+}
+
+/**
+ * Convert one OpenAI streaming chunk into a Gemini streaming chunk.
+ * Returns null for chunks that carry nothing worth forwarding (e.g. the
+ * initial role-only delta).
+ */
+function convertOpenAIChunkToGemini(openaiChunk) {
+    const choice = openaiChunk.choices?.[0];
+    const text = choice?.delta?.content || '';
+    const finishReason = choice?.finish_reason;
+    
+    if (!text && !finishReason && !openaiChunk.usage) {
+        return null;
+    }
+    
+    const candidate = {
+        content: {
+            parts: [{ text: text }],
+            role: 'model'
+        },
+        index: 0
+    };
+    if (finishReason) {
+        candidate.finishReason = convertFinishReason(finishReason);
+    }
+    
+    const geminiChunk = { candidates: [candidate] };
+    if (openaiChunk.usage) {
+        geminiChunk.usageMetadata = {
+            promptTokenCount: openaiChunk.usage.prompt_tokens || 0,
+            candidatesTokenCount: openaiChunk.usage.completion_tokens || 0,
+            totalTokenCount: openaiChunk.usage.total_tokens || 0
+        };
+    }
+    return geminiChunk;
+}
+
+/**
+ * Translate an OpenAI SSE body into a Gemini SSE body chunk by chunk,
+ * so the CLI sees tokens as soon as OpenAI produces them.
+ */
+function createGeminiStream(openaiBody) {
+    const reader = openaiBody.getReader();
+    const decoder = new TextDecoder();
+    const encoder = new TextEncoder();
+    let pending = '';
+    let chunkCount = 0;
+    
+    // Returns the encoded Gemini SSE event for one OpenAI line, or null
+    const convertLine = (line) => {
+        line = line.trim();
+        if (!line.startsWith('data:')) {
+            return null;
+        }
+        const payload = line.slice(5).trim();
+        if (!payload || payload === '[DONE]') {
+            return null;
+        }
+        const geminiChunk = convertOpenAIChunkToGemini(JSON.parse(payload));
+        if (!geminiChunk) {
+            return null;
+        }
+        chunkCount++;
+        return encoder.encode(`data: ${JSON.stringify(geminiChunk)}\n\n`);
+    };
+    
+    return new ReadableStream({
+        async pull(controller) {
+            try {
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) {
+                        const event = convertLine(pending + decoder.decode());
+                        if (event) {
+                            controller.enqueue(event);
+                        }
+                        logToFile(`✅ Streamed ${chunkCount} chunks back in Gemini format`);
+                        controller.close();
+                        return;
+                    }
+                    
+                    const lines = (pending + decoder.decode(value, { stream: true })).split('\n');
+                    pending = lines.pop();
+                    
+                    let emitted = false;
+                    for (const line of lines) {
+                        const event = convertLine(line);
+                        if (event) {
+                            controller.enqueue(event);
+                            emitted = true;
+                        }
+                    }
+                    if (emitted) {
+                        return;
+                    }
+                }
+            } catch (error) {
+                logToFile(`❌ OpenAI stream error: ${error.message}`);
+                controller.error(error);
+            }
+        },
+        cancel(reason) {
+            return reader.cancel(reason);
+        }
+    });
+}
+
 // Patch global fetch
 global.fetch = async function(url, options = {}) {
-    if (typeof url === 'string' && url.includes('generativelanguage.googleapis.com')) {
+    const geminiMatch = typeof url === 'string' ? GEMINI_API_URL_RE.exec(url) : null;
+    if (geminiMatch) {
         logToFile(`🎯 INTERCEPTED Gemini API call: ${url}`);
         
         try {
-            const geminiRequest = JSON.parse(options.body || '{}');
-            const userText = geminiRequest.contents?.[0]?.parts?.[0]?.text || 'unknown';
-            logToFile(`📥 Gemini request: ${userText.substring(0, 100)}...`);
+            const requestBody = options.body || '{}';
+            const requestBodyBytes = Buffer.byteLength(requestBody);
+            if (requestBodyBytes > MAX_REQUEST_BODY_BYTES) {
+                logToFile(`❌ Request body too large: ${requestBodyBytes} bytes (limit ${MAX_REQUEST_BODY_BYTES})`);
+                return createErrorResponse(413, `Request body exceeds ${MAX_REQUEST_BODY_BYTES} bytes`);
+            }
+            
+            const geminiRequest = JSON.parse(requestBody);
+            if (DEBUG_LOGGING) {
+                const userText = geminiRequest.contents?.[0]?.parts?.[0]?.text || 'unknown';
+                logToFile(`📥 Gemini request: ${userText.substring(0, 100)}...`);
+            }
             
-            const openaiRequest = convertGeminiToOpenAI(geminiRequest);
-            logToFile(`🔄 Converted to OpenAI format for model: ${openaiRequest.model}`);
+            const stream = geminiMatch[1] !== undefined;
+            const openaiRequest = convertGeminiToOpenAI(geminiRequest, stream);
+            logDebug(`🔄 Converted to OpenAI format for model: ${openaiRequest.model}`);
             
-            const openaiUrl = `${OPENAI_BASE_URL}/v1/chat/completions`;
-            const response = await originalFetch(openaiUrl, {
+            const openaiRequestBody = JSON.stringify(openaiRequest);
+            const cacheKey = !stream && openaiRequest.temperature === 0
+                ? crypto.createHash('sha256').update(openaiRequestBody).digest('base64')
+                : null;
+            if (cacheKey) {
+                const cachedBody = getCachedResponse(cacheKey);
+                if (cachedBody) {
+                    logToFile(`♻️ Serving cached response`);
+                    return createGeminiResponse(cachedBody);
+                }
+            }
+            
+            const response = await originalFetch(OPENAI_CHAT_URL, {
                 method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Authorization': `Bearer ${OPENAI_API_KEY}`,
-                    'User-Agent': 'GeminiCLI-OpenAI-Proxy/1.0'
-                },
-                body: JSON.stringify(openaiRequest)
+                headers: OPENAI_HEADERS,
+                body: openaiRequestBody
             });
             
             if (!response.ok) {
@@ -144,37 +406,40 @@ global.fetch = async function(url, options = {}) {
                 throw new Error(`OpenAI API error: ${response.status}`);
             }
             
+            if (stream) {
+                logToFile(`🌊 Streaming OpenAI response back in Gemini format`);
+                return new Response(createGeminiStream(response.body), {
+                    status: 200,
+                    statusText: 'OK',
+                    headers: STREAM_RESPONSE_HEADERS
+                });
+            }
+            
             const openaiResponse = await response.json();
             const geminiResponse = convertOpenAIToGemini(openaiResponse);
+            // Serialize once; text() may be called repeatedly by the CLI
+            const geminiResponseBody = JSON.stringify(geminiResponse);
             
-            const responseText = openaiResponse.choices?.[0]?.message?.content || 'no response';
-            logToFile(`📤 OpenAI response: ${responseText.substring(0, 100)}...`);
+            if (DEBUG_LOGGING) {
+                const responseText = openaiResponse.choices?.[0]?.message?.content || 'no response';
+                logToFile(`📤 OpenAI response: ${responseText.substring(0, 100)}...`);
+            }
             logToFile(`✅ Successfully converted back to Gemini format`);
             
-            return {
-                ok: true,
-                status: 200,
-                headers: {
-                    get: (key) => key === 'content-type' ? 'application/json' : null
-                },
-                json: async () => geminiResponse,
-                text: async () => JSON.stringify(geminiResponse),
-                clone: function() { return this; }
-            };
+            if (cacheKey && openaiResponse.choices?.length) {
+                setCachedResponse(cacheKey, geminiResponseBody);
+            }
+            
+            return createGeminiResponse(geminiResponseBody, geminiResponse);
             
         } catch (error) {
             logToFile(`❌ OpenAI Proxy error: ${error.message}`);
-            return {
-                ok: false,
-                status: 500,
-                json: async () => ({ error: { message: error.message } }),
-                text: async () => JSON.stringify({ error: { message: error.message } })
-            };
+            return createErrorResponse(500, error.message);
         }
     } else {
         // Pass through non-Gemini requests
         if (typeof url === 'string') {
-            logToFile(`🔍 Pass-through for: ${url}`);
+            logDebug(`🔍 Pass-through for: ${url}`);
         }
         return originalFetch(url, options);
     }